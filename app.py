@@ -1,142 +1,224 @@
 import os
+import atexit
 import csv
+import binascii
+import re
 import smtplib
 import ssl
 import socket
 import threading
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import uuid
+import hashlib
+import tempfile
 import sqlite3
 import time
+from collections import OrderedDict
+from itertools import islice
 from datetime import datetime, timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from email import policy
+from email.message import Message
 
 from flask import (Flask, request, render_template, redirect, url_for,
-                   flash, g)
+                   flash, g, jsonify)
+from flask.logging import default_handler
 from werkzeug.utils import secure_filename
-from jinja2 import Template # For rendering 
+from jinja2 import Environment, meta # For rendering
 
 # --- Global variables for rate limiting ---
 hourly_sent_count = 0
-current_hour_start_time = datetime.now() # Initialize to current time
+hourly_window_start = time.monotonic() # Start of the current rate limit window (monotonic clock)
 rate_limit_lock = threading.Lock()
 SMTP_HOURLY_LIMIT = 300 # Define the limit, e.g., 300
+RATE_LIMIT_WINDOW_SECONDS = 3600
+SEND_DELAY_SECONDS = 1.5 # Minimum gap between sends (SMTP transactions), even when the hourly budget would allow less
+
+# --- SMTP connection pool settings ---
+SMTP_MAX_PER_CONN = 500 # Reconnect after this many messages, before the provider drops the session
+SMTP_CONNECTIONS_PER_JOB = 4 # Most parallel SMTP sessions (and send workers) a job opens, as sends back up
+SMTP_POOL_MAX_IDLE_SECONDS = 240 # Idle pooled connections older than this are closed (checked on acquire and release)
+SMTP_MAX_CONNECTIONS = 8 # Open connections (in use or idle in the pool) per SMTP account, across all jobs
+smtp_pool = {} # smtp_pool_key(settings) -> (queue.Queue of idle SMTPConnection, slots semaphore)
+SMTP_POOL_KEY_SALT = os.urandom(16) # Per process, so pool keys can't be matched against precomputed hashes
+smtp_pool_lock = threading.Lock()
 
 # --- Configuration ---
 UPLOAD_FOLDER = 'uploads'
+# Recipient CSVs are only needed while their job runs, so they go to RAM-backed /dev/shm when available
+CSV_SPOOL_FOLDER = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else UPLOAD_FOLDER
+CSV_SPOOL_NAME_RE = re.compile(r'^bulk_mailer_pid(\d+)_') # Spooled CSVs carry the pid of the process whose job reads them
 ALLOWED_EXTENSIONS_CSV = {'csv'}
 ALLOWED_EXTENSIONS_HTML = {'html', 'htm'}
+PROGRESS_FLUSH_EVERY = 25 # Write sent/failed counts to the DB every N emails...
+PROGRESS_FLUSH_SECONDS = 5 # ...or after this many seconds, whichever comes first
+FAILED_FLUSH_EVERY = 500 # Buffered failed_emails rows that force an early flush
+REQUEST_DB_POOL_SIZE = 8 # Idle request connections kept open for reuse; extras are closed
+DASHBOARD_PAGE_SIZE = 50 # Jobs listed per dashboard page
+FAILURES_PAGE_SIZE = 200 # Failed recipients listed per failures page
+UPLOAD_BUFFER_SIZE = 1 << 20 # 1 MiB copy buffer when saving uploads (fewer read/write syscalls)
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$') # Cheap sanity check; rejects rows that could only fail at RCPT TO
+SMTP_MAX_LINE_OCTETS = 998 # RFC 5321 line length limit (excluding CRLF); longer lines force quoted-printable
+LONG_LINE_RE = re.compile(rb'[^\r\n]{%d}' % (SMTP_MAX_LINE_OCTETS + 1))
+TO_PLACEHOLDER = b'__TO__' # Sentinel value of the To: header while the shared header block is built
+BCC_BATCH_SIZE = 50 # Recipients per SMTP transaction when every recipient gets the same body
+BCC_TO_HEADER = b'undisclosed-recipients:;' # To: header for batched sends, so addresses stay hidden from each other
 DATABASE = 'instance/email_jobs.db' # Will be stored in instance folder
+EMAIL_TEMPLATE_CACHE_SIZE = 32 # Compiled email templates kept in memory (least recently used are dropped)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['SECRET_KEY'] = os.urandom(24) # Replace with a strong, fixed secret key in production
 app.config['DATABASE'] = DATABASE
 
+# Request handlers only queue their log records; a listener thread formats and writes
+# them, so an error storm doesn't block request threads on stderr
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler() # stderr, like Flask's default handler
+log_handler.setFormatter(default_handler.formatter)
+app.logger.removeHandler(default_handler)
+app.logger.addHandler(QueueHandler(log_queue))
+# The listener thread is started by the process that serves requests (see start_log_listener),
+# since threads don't survive a fork (e.g. gunicorn --preload)
+log_listener_pid = None
+log_listener_lock = threading.Lock()
+
+@app.before_request
+def start_log_listener():
+    """Starts the thread writing queued log records, once per process."""
+    global log_listener_pid
+    if log_listener_pid == os.getpid():
+        return
+    with log_listener_lock:
+        if log_listener_pid != os.getpid():
+            log_listener = QueueListener(log_queue, log_handler)
+            log_listener.start()
+            atexit.register(log_listener.stop) # Flushes queued records on exit
+            log_listener_pid = os.getpid()
+
 # Create upload folder if it doesn't exist
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 if not os.path.exists('instance'):
     os.makedirs('instance')
 
+# Shared environment for email templates (uploads are always HTML, so autoescape is on)
+JINJA_ENV = Environment(autoescape=True)
+# Every upload gets a unique filename, so compiled templates are cached by a hash of their source
+email_templates = OrderedDict() # sha256 of template source -> (compiled Template, variables it reads), LRU first
+email_templates_lock = threading.Lock()
+
 # --- Database Setup ---
 
+# Statements issued from the send loop. Keeping them as shared constants means each
+# call hits the connection's prepared-statement cache instead of being re-parsed
+SQL_UPDATE_STATUS = "UPDATE jobs SET status = ? WHERE job_uuid = ?"
+SQL_UPDATE_PROGRESS = "UPDATE jobs SET sent_count = ?, failed_count = ? WHERE job_uuid = ?"
+SQL_INSERT_FAILED = "INSERT INTO failed_emails (job_uuid, recipient_email, error_message, timestamp) VALUES (?, ?, ?, ?)"
+# Read paths hit on every dashboard refresh/poll; one string each, so they stay in the connection's statement cache
+SQL_SELECT_JOBS_PAGE = (
+    "SELECT job_uuid, status, subject, csv_filename, html_filename, total_emails, sent_count, failed_count, start_time, end_time "
+    "FROM jobs ORDER BY start_time DESC, id DESC LIMIT ? OFFSET ?"
+)
+SQL_SELECT_JOB_SUMMARY = "SELECT job_uuid, subject, failed_count FROM jobs WHERE job_uuid = ?"
+SQL_SELECT_FAILURES_PAGE = (
+    "SELECT recipient_email, error_message, timestamp FROM failed_emails WHERE job_uuid = ? "
+    "ORDER BY timestamp DESC LIMIT ? OFFSET ?"
+)
+SQL_SELECT_JOB_STATUS = "SELECT status, total_emails, sent_count, failed_count, end_time FROM jobs WHERE job_uuid = ?"
+
+# WAL lets the dashboard read while a sending job writes; NORMAL sync drops an fsync per commit
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA busy_timeout=30000;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+PRAGMA mmap_size=268435456;
+"""
+
+# Set once indexes.sql has run in this process, so existing databases pick up new indexes
+# without init-db (which drops every table)
+db_indexes_applied = False
+
+def apply_indexes(db):
+    """Creates any missing indexes; tables and data are left alone."""
+    with app.open_resource('indexes.sql', mode='r') as f:
+        db.executescript(f.read())
+
+def connect_db(check_same_thread=True):
+    """Opens a new connection to the database with the connection pragmas applied."""
+    global db_indexes_applied
+    db = sqlite3.connect(
+        app.config['DATABASE'],
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        cached_statements=256,
+        check_same_thread=check_same_thread
+    )
+    db.executescript(SQLITE_PRAGMAS)
+    if not db_indexes_applied:
+        try:
+            apply_indexes(db)
+            db_indexes_applied = True
+        except sqlite3.OperationalError as e: # No tables yet (before init-db); retried on the next connection
+            print(f"Skipping index creation: {e}")
+    return db
+
+# Request connections are pooled and reused across requests (and threads: the threaded dev server
+# starts one per request), so a dashboard refresh doesn't pay for connect() and the pragmas each time
+request_db_pool = queue.LifoQueue(maxsize=REQUEST_DB_POOL_SIZE) # LIFO keeps reusing the warmest connections
+
 def get_db():
-    """Connects to the specific database."""
-    db = getattr(g, '_database', None)
+    """Returns the request's database connection, taken from the pool (or opened) on first use."""
+    db = g.get('db')
     if db is None:
-        db = g._database = sqlite3.connect(
-            app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
-        )
-        db.row_factory = sqlite3.Row # Return rows as dict-like objects
+        try:
+            db = request_db_pool.get_nowait()
+        except queue.Empty:
+            # Used by one request at a time, but handed between threads through the pool
+            db = connect_db(check_same_thread=False)
+            db.row_factory = sqlite3.Row # Return rows as dict-like objects
+        g.db = db
     return db
 
 @app.teardown_appcontext
-def close_connection(exception):
-    """Closes the database again at the end of the request."""
-    db = getattr(g, '_database', None)
-    if db is not None:
+def release_db(exception):
+    """Discards anything the request left uncommitted and returns its connection to the pool."""
+    db = g.pop('db', None)
+    if db is None:
+        return
+    try:
+        if db.in_transaction:
+            db.rollback()
+        request_db_pool.put_nowait(db)
+    except (sqlite3.Error, queue.Full): # Unusable, or the pool already holds enough idle connections
         db.close()
 
+@atexit.register
+def close_request_dbs():
+    """Closes the pooled request connections on interpreter exit."""
+    while True:
+        try:
+            request_db_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
 def init_db():
     """Initializes the database schema."""
     with app.app_context():
         db = get_db()
         with app.open_resource('schema.sql', mode='r') as f:
             db.cursor().executescript(f.read())
+        apply_indexes(db)
         db.commit()
     print("Database initialized.")
 
-# Create schema.sql file in the same directory as app.py
-# Content of schema.sql:
-"""
-DROP TABLE IF EXISTS jobs;
-DROP TABLE IF EXISTS failed_emails;
-
-CREATE TABLE jobs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    job_uuid TEXT UNIQUE NOT NULL,
-    csv_filename TEXT NOT NULL,
-    html_filename TEXT NOT NULL,
-    subject TEXT NOT NULL,
-    sender_email TEXT NOT NULL,
-    status TEXT NOT NULL DEFAULT 'Pending', -- Pending, Running, Completed, Failed, Partial Failure
-    total_emails INTEGER,
-    sent_count INTEGER DEFAULT 0,
-    failed_count INTEGER DEFAULT 0,
-    start_time TIMESTAMP,
-    end_time TIMESTAMP
-);
-
-CREATE TABLE failed_emails (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    job_uuid TEXT NOT NULL,
-    recipient_email TEXT NOT NULL,
-    error_message TEXT,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (job_uuid) REFERENCES jobs (job_uuid)
-);
-"""
-
-# Initialize DB if it doesn't exist (run this once manually or check existence)
-# Consider using Flask CLI command for this: `flask init-db`
-# Check if DB file exists before trying to init
-db_path = os.path.join(app.instance_path, os.path.basename(DATABASE))
-if not os.path.exists(db_path):
-    # Create the schema.sql file first!
-    schema_content = """
-    DROP TABLE IF EXISTS jobs;
-    DROP TABLE IF EXISTS failed_emails;
-
-    CREATE TABLE jobs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        job_uuid TEXT UNIQUE NOT NULL,
-        csv_filename TEXT NOT NULL,
-        html_filename TEXT NOT NULL,
-        subject TEXT NOT NULL,
-        sender_email TEXT NOT NULL,
-        status TEXT NOT NULL DEFAULT 'Pending', -- Pending, Running, Completed, Failed, Partial Failure
-        total_emails INTEGER,
-        sent_count INTEGER DEFAULT 0,
-        failed_count INTEGER DEFAULT 0,
-        start_time TIMESTAMP,
-        end_time TIMESTAMP
-    );
-
-    CREATE TABLE failed_emails (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        job_uuid TEXT NOT NULL,
-        recipient_email TEXT NOT NULL,
-        error_message TEXT,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (job_uuid) REFERENCES jobs (job_uuid)
-    );
-    """
-    with open('schema.sql', 'w') as f:
-        f.write(schema_content)
+@app.cli.command('init-db')
+def init_db_command():
+    """Clear existing data and create new tables."""
     init_db()
-    os.remove('schema.sql') # Clean up schema file after use
 
 # --- Helper Functions ---
 
@@ -145,21 +227,344 @@ def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-def send_emails_background(job_uuid, csv_path, html_path, subject, sender_email, sender_password, smtp_server, smtp_port, use_tls, use_ssl):
+def wants_json():
+    """True when the client asked for JSON (the send form submits with fetch()) rather than a page."""
+    return request.accept_mimetypes.best == 'application/json'
+
+def submit_error(message, category='danger', status=400):
+    """Rejects a job submission: JSON for fetch() clients, otherwise flash and back to the form."""
+    if wants_json():
+        return jsonify(error=message), status
+    flash(message, category)
+    return redirect(request.url)
+
+def sweep_csv_spool():
+    """
+    Deletes spooled CSVs whose process has exited. A job killed by a restart never reaches
+    its own cleanup, and its recipient list would otherwise stay in /dev/shm until reboot.
+    """
+    if os.name != 'posix': # os.kill(pid, 0) only probes for the process on POSIX
+        return
+    for folder in {CSV_SPOOL_FOLDER, UPLOAD_FOLDER}:
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            continue
+        for name in names:
+            match = CSV_SPOOL_NAME_RE.match(name)
+            if not match:
+                continue
+            try:
+                os.kill(int(match.group(1)), 0)
+                continue # Still running (possibly another worker), its job may be reading the file
+            except ProcessLookupError:
+                pass
+            except OSError: # No permission to signal it, so it is alive
+                continue
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+
+def spool_csv(csv_file, upload_tag):
+    """Saves an uploaded recipient CSV to CSV_SPOOL_FOLDER (UPLOAD_FOLDER if that fails) and returns its path."""
+    sweep_csv_spool()
+    folders = [CSV_SPOOL_FOLDER] if CSV_SPOOL_FOLDER == UPLOAD_FOLDER else [CSV_SPOOL_FOLDER, UPLOAD_FOLDER]
+    for folder in folders:
+        csv_path = None
+        try:
+            # The spool folder may be shared (/dev/shm), so the CSV gets an exclusively created random name
+            with tempfile.NamedTemporaryFile(dir=folder, prefix=f"bulk_mailer_pid{os.getpid()}_{upload_tag}_",
+                                             suffix='.csv', delete=False) as csv_spool:
+                csv_path = csv_spool.name
+                csv_file.stream.seek(0) # A failed attempt may already have read part of the upload
+                csv_file.save(csv_spool, buffer_size=UPLOAD_BUFFER_SIZE)
+            return csv_path
+        except OSError as e: # e.g. ENOSPC: /dev/shm is only 64 MiB in a default Docker container
+            if csv_path and os.path.exists(csv_path):
+                os.remove(csv_path)
+            if folder == folders[-1]:
+                raise
+            app.logger.warning("Could not spool CSV to %s, saving it to %s instead: %s", folder, UPLOAD_FOLDER, e)
+
+def build_header_template(subject, sender_email):
+    """
+    Builds the RFC 822 header block shared by every message in a job.
+    Returns it split around the To: value as (head, tail), so each send only joins
+    head + recipient + tail + encoded body (see encode_body, which adds the
+    Content-Transfer-Encoding header and the blank line).
+    """
+    header = Message(policy=policy.SMTP) # CRLF line endings, RFC 2047 encoded Subject
+    header['Subject'] = subject
+    header['From'] = sender_email
+    header['To'] = TO_PLACEHOLDER.decode('ascii')
+    header['MIME-Version'] = '1.0'
+    header['Content-Type'] = 'text/html; charset="utf-8"'
+    # Split on the whole To: line, so a sentinel inside the Subject can't be picked up instead
+    head, _, tail = header.as_bytes().partition(b'\r\nTo: ' + TO_PLACEHOLDER + b'\r\n')
+    return head + b'\r\nTo: ', b'\r\n' + tail[:-2] # Drop the blank separator line; encode_body adds it
+
+def iter_recipients(csv_path, skipped=None):
+    """
+    Yields (first_name, email) for each valid row of the recipient CSV, once per address.
+    The file is streamed; only the set of addresses seen so far is kept in memory.
+    Rows that are skipped (invalid or duplicate address) are appended to the
+    skipped list, when given, as (CSV row number, address, reason).
+    """
+    with open(csv_path, mode='r', encoding='utf-8-sig', newline='') as csvfile: # utf-8-sig handles BOM
+        reader = csv.reader(csvfile) # Plain lists per row; columns are looked up by index
+
+        # Flexible column name check (case-insensitive)
+        fieldnames_lower = [name.lower() for name in next(reader, [])]
+        if 'firstname' not in fieldnames_lower or 'email' not in fieldnames_lower:
+             raise ValueError("CSV must contain 'FirstName' and 'Email' columns (case-insensitive).")
+
+        first_name_idx = fieldnames_lower.index('firstname')
+        email_idx = fieldnames_lower.index('email')
+
+        seen = set() # Lower-cased addresses already yielded
+        for i, row in enumerate(reader):
+            if not any(field.strip() for field in row):
+                continue # Blank line
+            email_addr = row[email_idx].strip() if email_idx < len(row) else ''
+            first_name = row[first_name_idx].strip() if first_name_idx < len(row) else '' # Handle missing FirstName gracefully
+
+            if not EMAIL_RE.match(email_addr):
+                reason = 'Invalid email address'
+            elif email_addr.lower() in seen:
+                reason = 'Duplicate email address'
+            else:
+                seen.add(email_addr.lower())
+                yield first_name, email_addr
+                continue
+            if skipped is not None:
+                skipped.append((i + 2, email_addr, reason)) # +2 for header and 0-index
+
+def load_email_template(html_path):
+    """
+    Returns (compiled Jinja template, names of the variables it reads) for an uploaded HTML file.
+    Templates with the same source (the same file uploaded for another job) are only parsed and compiled once.
+    """
+    with open(html_path, 'rb') as f:
+        source = f.read()
+    key = hashlib.sha256(source).hexdigest()
+    with email_templates_lock:
+        entry = email_templates.get(key)
+        if entry is not None:
+            email_templates.move_to_end(key)
+            return entry
+    ast = JINJA_ENV.parse(source.decode('utf-8')) # One parse serves both the variable scan and compiling
+    entry = (JINJA_ENV.from_string(ast), meta.find_undeclared_variables(ast))
+    with email_templates_lock:
+        email_templates[key] = entry
+        if len(email_templates) > EMAIL_TEMPLATE_CACHE_SIZE:
+            email_templates.popitem(last=False)
+    return entry
+
+def reserve_send_slots(count, outstanding):
+    """
+    Takes up to `count` sends from the hourly budget shared by all jobs.
+    Returns (granted, wait_seconds, pace_seconds): granted is 0 once the limit is reached, and
+    wait_seconds is then the time until the window resets. pace_seconds is how long to wait
+    before the next send: SEND_DELAY_SECONDS while the job's `outstanding` recipients fit in the
+    budget left, otherwise the remaining budget spread across what is left of the window (never
+    less than SEND_DELAY_SECONDS).
+    """
+    global hourly_sent_count, hourly_window_start
+    with rate_limit_lock: # Held only for the counter arithmetic
+        now = time.monotonic()
+        # Check if the 1-hour window has passed, reset if necessary
+        if now >= hourly_window_start + RATE_LIMIT_WINDOW_SECONDS:
+            print(f"Rate limit window has expired. Resetting count from {hourly_sent_count}.")
+            hourly_sent_count = 0
+            hourly_window_start = now
+        window_left = hourly_window_start + RATE_LIMIT_WINDOW_SECONDS - now
+        budget = SMTP_HOURLY_LIMIT - hourly_sent_count
+        if budget <= 0:
+            return 0, window_left, 0
+        granted = min(count, budget)
+        # Reserve the slots now, since the send itself completes on a worker later
+        hourly_sent_count += granted
+    # A job that can't finish within this window gains nothing from bursting and then stalling
+    pace_seconds = 0 if outstanding <= budget else granted * window_left / budget
+    return granted, 0, max(pace_seconds, SEND_DELAY_SECONDS)
+
+def render_body(email_template, first_name, email):
+    """Renders one personalized HTML body as CRLF-terminated UTF-8 bytes."""
+    personalized_html = email_template.render(
+        first_name=first_name,
+        email=email
+        # Add any other variables from CSV if needed
+    )
+    return personalized_html.replace('\r\n', '\n').replace('\n', '\r\n').encode('utf-8')
+
+def encode_body(body, allow_8bit):
+    """
+    Returns the Content-Transfer-Encoding header, the blank line ending the headers and the body.
+    The body goes out unencoded when every line fits SMTP's limit and it is ASCII or the
+    server accepts 8bit data; otherwise it is quoted-printable encoded.
+    """
+    if not LONG_LINE_RE.search(body):
+        if body.isascii():
+            return b'Content-Transfer-Encoding: 7bit\r\n\r\n' + body
+        if allow_8bit:
+            return b'Content-Transfer-Encoding: 8bit\r\n\r\n' + body
+    # b2a_qp uses bare LF for soft line breaks when the body has no CRLF of its own
+    encoded = binascii.b2a_qp(body, istext=True).replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+    return b'Content-Transfer-Encoding: quoted-printable\r\n\r\n' + encoded
+
+# --- SMTP Connection Pool ---
+
+class SMTPConnection:
+    """
+    An authenticated SMTP session that can be returned to the pool and reused by later jobs.
+    Transparently reconnects once SMTP_MAX_PER_CONN messages have gone through it.
+    """
+    def __init__(self, smtp_server, smtp_port, sender_email, sender_password, use_tls, use_ssl, timeout):
+        self.settings = (smtp_server, smtp_port, sender_email, sender_password, use_tls, use_ssl) # Needed to reconnect
+        self.pool_key = smtp_pool_key(*self.settings)
+        self.timeout = timeout
+        self.server = None
+        self.msgs_sent = 0
+        self.last_used = time.monotonic()
+        self.connect()
+
+    def connect(self):
+        """Opens the connection, negotiates TLS/SSL and logs in."""
+        smtp_server, smtp_port, sender_email, sender_password, use_tls, use_ssl = self.settings
+        context = ssl.create_default_context()
+        if use_ssl:
+            self.server = smtplib.SMTP_SSL(smtp_server, smtp_port, context=context, timeout=self.timeout)
+        else:
+            self.server = smtplib.SMTP(smtp_server, smtp_port, timeout=self.timeout)
+            if use_tls:
+                self.server.starttls(context=context)
+        self.server.login(sender_email, sender_password)
+        self.msgs_sent = 0
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=()):
+        """
+        Sends one message, rotating the underlying connection at the per-connection cap.
+        If the server has dropped the session, reconnects and retries once before giving up.
+        """
+        if self.msgs_sent >= SMTP_MAX_PER_CONN:
+            self.close()
+            self.connect()
+        try:
+            refused = self.server.sendmail(from_addr, to_addrs, msg, mail_options)
+        except smtplib.SMTPServerDisconnected as e_disconnect:
+            self.close()
+            try:
+                self.connect()
+            except (smtplib.SMTPException, OSError) as e_reconnect:
+                raise e_disconnect from e_reconnect
+            refused = self.server.sendmail(from_addr, to_addrs, msg, mail_options)
+        self.msgs_sent += 1
+        self.last_used = time.monotonic()
+        return refused
+
+    def is_alive(self):
+        """Checks a pooled connection is still usable before handing it out again."""
+        if time.monotonic() - self.last_used > SMTP_POOL_MAX_IDLE_SECONDS:
+            return False
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self):
+        """Quits the session, ignoring errors from an already dropped connection."""
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+def smtp_pool_key(smtp_server, smtp_port, sender_email, sender_password, use_tls, use_ssl):
+    """Pool key for a set of SMTP settings; a salted hash, so the password is not kept as a dict key."""
+    settings = repr((smtp_server, smtp_port, sender_email, sender_password, use_tls, use_ssl))
+    return hashlib.sha256(SMTP_POOL_KEY_SALT + settings.encode('utf-8')).hexdigest()
+
+def get_smtp_pool(key):
+    """Returns the (idle queue, connection slots) pair for a pool key, creating it on first use."""
+    with smtp_pool_lock:
+        if key not in smtp_pool:
+            smtp_pool[key] = (queue.Queue(), threading.BoundedSemaphore(SMTP_MAX_CONNECTIONS))
+        return smtp_pool[key]
+
+def acquire_smtp_connection(smtp_server, smtp_port, sender_email, sender_password, use_tls, use_ssl, timeout, wait=True):
+    """
+    Returns an idle pooled connection for these settings if a live one exists, otherwise opens a new
+    one once a connection slot is free. With wait=False, returns None instead of waiting for a slot.
+    Setup errors (auth, DNS, TLS, ...) propagate to the caller.
+    """
+    idle, slots = get_smtp_pool(smtp_pool_key(smtp_server, smtp_port, sender_email, sender_password, use_tls, use_ssl))
+    while True:
+        try:
+            conn = idle.get_nowait()
+        except queue.Empty:
+            # Wait in short steps so a connection another job releases to the idle queue is picked up
+            if not (slots.acquire(timeout=1) if wait else slots.acquire(blocking=False)):
+                if not wait:
+                    return None
+                continue
+            try:
+                return SMTPConnection(smtp_server, smtp_port, sender_email, sender_password, use_tls, use_ssl, timeout)
+            except BaseException:
+                slots.release()
+                raise
+        if conn.is_alive():
+            return conn
+        retire_smtp_connection(conn)
+
+def release_smtp_connection(conn):
+    """Returns a healthy connection to the pool for reuse by the next job."""
+    conn.last_used = time.monotonic()
+    idle, _ = get_smtp_pool(conn.pool_key)
+    idle.put(conn)
+    close_idle_smtp_connections()
+
+def close_idle_smtp_connections():
+    """
+    Closes pooled connections idle for longer than SMTP_POOL_MAX_IDLE_SECONDS, for every account,
+    so sessions (and slots) of accounts that never send again aren't held forever.
+    """
+    cutoff = time.monotonic() - SMTP_POOL_MAX_IDLE_SECONDS
+    with smtp_pool_lock:
+        pools = list(smtp_pool.values())
+    for idle, _ in pools:
+        fresh = []
+        while True:
+            try:
+                conn = idle.get_nowait()
+            except queue.Empty:
+                break
+            if conn.last_used < cutoff:
+                retire_smtp_connection(conn)
+            else:
+                fresh.append(conn)
+        for conn in fresh:
+            idle.put(conn)
+
+def retire_smtp_connection(conn):
+    """Closes a connection for good and frees its slot."""
+    conn.close()
+    _, slots = get_smtp_pool(conn.pool_key)
+    slots.release()
+
+def send_emails_background(job_uuid, csv_path, html_path, subject, sender_email, sender_password, smtp_server, smtp_port, use_tls, use_ssl,
+                           recipient_count, skipped_count):
     """
     Function to send emails in a separate thread with delays and error handling.
     """
-    global hourly_sent_count, current_hour_start_time
     # --- Configuration ---
-    # Use current_app to access Flask app config within the thread context
-    SEND_DELAY_SECONDS = 1.5  # Start with 1.5 seconds delay. Adjust as needed (1-5 seconds is common).
     CONNECTION_TIMEOUT = 30 # Seconds to wait for SMTP connection/commands
 
-    # Need to create an app context to access 'g', 'current_app', etc. in the thread
-        # Use the global 'app' instance defined in your script (e.g., app = Flask(__name__))
-    with app.app_context():
-        db = get_db() # Get DB connection within the app context
-        start_time = datetime.now()
+    # The job owns its own connection, separate from the request connections in get_db(),
+    # and closes it when it finishes
+    db = connect_db()
+    try:
+        start_time = datetime.now() # Wall-clock times are only taken for DB records and logs
+        started_at = time.monotonic() # Elapsed-time math uses the monotonic clock
         print(f"Background job {job_uuid[:8]} started at {start_time}")
 
         # Update job status to Running
@@ -173,67 +578,24 @@ def send_emails_background(job_uuid, csv_path, html_path, subject, sender_email,
             return
 
         sent_count = 0
-        failed_count = 0
-        total_emails = 0
-        recipients = []
+        failed_count = skipped_count # Skipped CSV rows were recorded as failures when the job was created
+        # Every CSV row is accounted for: sent + failed reaches the total when the job finishes
+        total_emails = recipient_count + skipped_count
         initial_error = None # To store errors happening before the loop
 
-        # 1. Read CSV and Prepare Recipient List
-        try:
-            with open(csv_path, mode='r', encoding='utf-8-sig') as csvfile: # utf-8-sig handles BOM
-                reader = csv.DictReader(csvfile)
-
-                # Flexible column name check (case-insensitive)
-                fieldnames_lower = [name.lower() for name in reader.fieldnames or []]
-                if 'firstname' not in fieldnames_lower or 'email' not in fieldnames_lower:
-                     raise ValueError("CSV must contain 'FirstName' and 'Email' columns (case-insensitive).")
-
-                # Find the actual case used in the header
-                first_name_col = next((name for name in reader.fieldnames if name.lower() == 'firstname'), None)
-                email_col = next((name for name in reader.fieldnames if name.lower() == 'email'), None)
-
-                if not first_name_col or not email_col: # Should not happen if checks above passed, but safer
-                    raise ValueError("Could not find 'FirstName' or 'Email' column headers.")
-
-                for i, row in enumerate(reader):
-                    email_addr = row.get(email_col, '').strip()
-                    first_name = row.get(first_name_col, '').strip() # Handle missing FirstName gracefully
-
-                    if email_addr and '@' in email_addr:
-                        recipients.append({
-                            'email': email_addr,
-                            'first_name': first_name
-                        })
-                    else:
-                        print(f"Job {job_uuid[:8]}: Skipping invalid email in CSV row {i+2}: {email_addr}") # +2 for header and 0-index
-
-            total_emails = len(recipients)
-            print(f"Job {job_uuid[:8]}: Found {total_emails} valid recipients in CSV.")
-            db.execute("UPDATE jobs SET total_emails = ? WHERE job_uuid = ?", (total_emails, job_uuid))
-            db.commit()
-
-            if total_emails == 0:
-                 initial_error = "Completed (No valid recipients found)"
-                 print(f"Job {job_uuid[:8]}: {initial_error}")
-
-
-        except FileNotFoundError:
-            initial_error = f'Failed: CSV file not found at {csv_path}'
-            print(f"Job {job_uuid[:8]}: {initial_error}")
-        except ValueError as e:
-             initial_error = f'Failed: Error reading CSV - {e}'
+        # 1. Recipients were counted (the CSV is streamed again by the send loop) when the job was submitted
+        print(f"Job {job_uuid[:8]}: Found {recipient_count} valid recipients in CSV, skipping {skipped_count} rows.")
+        if recipient_count == 0:
+             initial_error = "Completed (No valid recipients found)"
              print(f"Job {job_uuid[:8]}: {initial_error}")
-        except Exception as e:
-            initial_error = f'Failed: Unexpected error reading CSV - {type(e).__name__}: {e}'
-            print(f"Job {job_uuid[:8]}: {initial_error}")
 
         # 2. Read HTML Template (only if no CSV error and recipients exist)
         email_template = None
-        if not initial_error and total_emails > 0:
+        template_vars = set() # Variables the template reads from its render context
+        if not initial_error and recipient_count > 0:
             try:
-                with open(html_path, mode='r', encoding='utf-8') as f:
-                    html_content_template = f.read()
-                email_template = Template(html_content_template) # Use Jinja2 for personalization
+                # Use Jinja2 for personalization (compiled once per distinct template source)
+                email_template, template_vars = load_email_template(html_path)
                 print(f"Job {job_uuid[:8]}: Successfully loaded HTML template.")
             except FileNotFoundError:
                 initial_error = f'Failed: HTML template not found at {html_path}'
@@ -242,6 +604,18 @@ def send_emails_background(job_uuid, csv_path, html_path, subject, sender_email,
                  initial_error = f'Failed: Error reading HTML - {type(e).__name__}: {e}'
                  print(f"Job {job_uuid[:8]}: {initial_error}")
 
+        # 2b. Render the first recipient's body, so template errors surface before connecting
+        static_body = None # Set when the template is not personalized: one body is shared by every recipient
+        if not initial_error and email_template is not None:
+            try:
+                first_body = render_body(email_template, *next(iter_recipients(csv_path)))
+                if not template_vars & {'first_name', 'email'}:
+                    static_body = first_body
+                    print(f"Job {job_uuid[:8]}: Template has no personalization; rendering it once for all recipients.")
+            except Exception as e:
+                initial_error = f'Failed: Error rendering HTML - {type(e).__name__}: {e}'
+                print(f"Job {job_uuid[:8]}: {initial_error}")
+
         # If there was an error reading files or no recipients, stop early
         if initial_error:
             try:
@@ -253,158 +627,209 @@ def send_emails_background(job_uuid, csv_path, html_path, subject, sender_email,
             return # Stop the background task
 
         # 3. Connect to SMTP and Send Emails
-        server = None
+        smtp_conns = [] # Every connection this job holds; returned to the pool (or closed) at the end
+        failed_buffer = [] # failed_emails rows (stamped when they fail) waiting to be written with executemany
         connection_error = None
         try:
-            print(f"Job {job_uuid[:8]}: Attempting SMTP connection to {smtp_server}:{smtp_port}...")
-            context = ssl.create_default_context()
-            if use_ssl:
-                server = smtplib.SMTP_SSL(smtp_server, smtp_port, context=context, timeout=CONNECTION_TIMEOUT)
-                print(f"Job {job_uuid[:8]}: Connected via SMTP_SSL.")
-            else:
-                server = smtplib.SMTP(smtp_server, smtp_port, timeout=CONNECTION_TIMEOUT)
-                print(f"Job {job_uuid[:8]}: Connected via SMTP.")
-                if use_tls:
-                    print(f"Job {job_uuid[:8]}: Starting TLS...")
-                    server.starttls(context=context)
-                    print(f"Job {job_uuid[:8]}: TLS negotiation successful.")
+            print(f"Job {job_uuid[:8]}: Acquiring SMTP connection to {smtp_server}:{smtp_port} as {sender_email}...")
+            # Reuses an authenticated connection left by an earlier job when one is available
+            smtp_conns.append(acquire_smtp_connection(smtp_server, smtp_port, sender_email, sender_password,
+                                                      use_tls, use_ssl, CONNECTION_TIMEOUT))
+            print(f"Job {job_uuid[:8]}: SMTP connection ready.")
+            idle_conns = queue.Queue() # Connections not currently in use by a send worker
+            idle_conns.put(smtp_conns[0])
+            can_add_conns = True # Cleared once an extra connection can't be opened
+
+            # Headers are identical across recipients, so serialize them once per job
+            header_head, header_tail = build_header_template(subject, sender_email)
+            # UTF-8 bodies go out as raw 8bit bytes only when the server advertises support
+            allow_8bit = smtp_conns[0].server.has_extn('8bitmime')
+            mail_options = ['BODY=8BITMIME'] if allow_8bit else []
+            # A shared body is encoded once for the whole job
+            static_part = encode_body(static_body, allow_8bit) if static_body is not None else None
+
+            # Progress is committed in batches (see PROGRESS_FLUSH_*) rather than once per email
+            pending_progress = 0
+            last_progress_flush = time.monotonic()
+            current_status = 'Running' # Last status written to the DB; skips redundant status updates
+
+            # Sends go out as fast as the connections allow while the hourly budget covers the rest
+            # of the job; only a job bigger than the remaining budget is spread across the window
+            next_send_at = float('-inf')
+
+            def send_one(first_name, to_addrs):
+                """Runs on a send worker: renders the message and sends it on a free connection.
+
+                Several addresses share one transaction (as Bcc) only when the body is not personalized.
+                Returns the refused-recipients dict from sendmail.
+                """
+                # Only the To: header and the body differ between recipients
+                if static_part is not None:
+                    body = static_part
+                else:
+                    body = encode_body(render_body(email_template, first_name, to_addrs[0]), allow_8bit)
+                to_header = to_addrs[0].encode('utf-8') if len(to_addrs) == 1 else BCC_TO_HEADER
+                raw_message = b''.join((header_head, to_header, header_tail, body))
+                conn = idle_conns.get()
+                try:
+                    return conn.sendmail(sender_email, to_addrs, raw_message, mail_options)
+                finally:
+                    idle_conns.put(conn)
+
+            in_flight = {} # Future -> (recipient addresses, log label) for sends not yet recorded
+
+            def record_results(done):
+                """Records finished sends (on the job thread, which owns the DB connection)."""
+                nonlocal sent_count, failed_count, connection_error, pending_progress, last_progress_flush
+                for future in done:
+                    to_addrs, current_recipient_log = in_flight.pop(future)
+                    to_email = ', '.join(to_addrs)
+                    try:
+                        refused = future.result()
+                        sent_count += len(to_addrs) - len(refused)
+                        # A batched send succeeds if any recipient was accepted; log the ones that weren't
+                        for refused_email, (code, reply) in refused.items():
+                            failed_count += 1
+                            failed_buffer.append((job_uuid, refused_email, f"{code} {reply.decode('utf-8', 'replace')}", datetime.now()))
+                        # print(f"Job {job_uuid[:8]}: Successfully sent to {current_recipient_log}") # Verbose
+
+                    except smtplib.SMTPServerDisconnected:
+                         # Specific handling for disconnect DURING the loop
+                         failed_count += len(to_addrs)
+                         error_msg_detail = "Server disconnected unexpectedly (mid-send). Might be rate limited or timed out."
+                         error_msg_short = "SMTPServerDisconnected (mid-send)"
+                         print(f"Job {job_uuid[:8]}: Failed sending to {current_recipient_log} - {error_msg_detail}")
+                         # Log failure to DB (buffered; flushed by the final update below)
+                         failed_buffer.extend((job_uuid, addr, error_msg_short, datetime.now()) for addr in to_addrs)
+                         if not connection_error:
+                             print(f"Job {job_uuid[:8]}: Stopping due to mid-send disconnection.")
+                         # Set connection_error flag so no further sends are dispatched
+                         connection_error = error_msg_detail
+
+                    except smtplib.SMTPException as e_send: # Catch other SMTP errors during send
+                        failed_count += len(to_addrs)
+                        error_msg = f"SMTP Error sending to {to_email}: {type(e_send).__name__} - {e_send}"
+                        print(f"Job {job_uuid[:8]}: {error_msg}")
+                        failed_buffer.extend((job_uuid, addr, str(e_send), datetime.now()) for addr in to_addrs)
+                        # Decide if you want to continue or break on other SMTP errors too (e.g., recipient rejected)
+                        # For now, we continue to try the next recipient unless it was a disconnect.
+
+                    except Exception as e_send_general: # Catch non-SMTP errors during send (e.g., template rendering)
+                        failed_count += len(to_addrs)
+                        error_msg = f"General Error sending to {to_email}: {type(e_send_general).__name__} - {e_send_general}"
+                        print(f"Job {job_uuid[:8]}: {error_msg}")
+                        failed_buffer.extend((job_uuid, addr, str(e_send_general), datetime.now()) for addr in to_addrs)
+                        # Continue trying next recipient
+
+                    # Flush progress and buffered failure rows in one commit per batch
+                    pending_progress += 1
+                    if (pending_progress >= PROGRESS_FLUSH_EVERY or len(failed_buffer) >= FAILED_FLUSH_EVERY
+                            or time.monotonic() - last_progress_flush >= PROGRESS_FLUSH_SECONDS):
+                        if failed_buffer:
+                            db.executemany(SQL_INSERT_FAILED, failed_buffer)
+                            failed_buffer.clear()
+                        db.execute(SQL_UPDATE_PROGRESS, (sent_count, failed_count, job_uuid))
+                        db.commit()
+                        pending_progress = 0
+                        last_progress_flush = time.monotonic()
+
+            def add_connection_if_busy():
+                """Opens another connection when every one this job holds is busy (up to SMTP_CONNECTIONS_PER_JOB)."""
+                nonlocal can_add_conns
+                if not can_add_conns or not idle_conns.empty() or len(smtp_conns) >= SMTP_CONNECTIONS_PER_JOB:
+                    return
+                # Best effort: some providers cap concurrent sessions per account,
+                # and SMTP_MAX_CONNECTIONS caps them across all jobs here
+                try:
+                    extra_conn = acquire_smtp_connection(smtp_server, smtp_port, sender_email, sender_password,
+                                                         use_tls, use_ssl, CONNECTION_TIMEOUT, wait=False)
+                except (smtplib.SMTPException, OSError) as e_extra:
+                    print(f"Job {job_uuid[:8]}: Could not open another SMTP connection, continuing with {len(smtp_conns)}: {e_extra}")
+                    extra_conn = None
+                if extra_conn is None: # Connection limit for this account reached, or the open failed
+                    can_add_conns = False
+                    return
+                smtp_conns.append(extra_conn)
+                idle_conns.put(extra_conn)
+                print(f"Job {job_uuid[:8]}: Sends are backing up; now using {len(smtp_conns)} SMTP connections.")
+
+            def dispatch(first_name, to_addrs, current_recipient_log):
+                """Queues one send on the worker pool, bounding how many are in flight."""
+                add_connection_if_busy()
+                # print(f"Job {job_uuid[:8]}: Sending to {current_recipient_log}...") # Verbose
+                in_flight[executor.submit(send_one, first_name, to_addrs)] = (to_addrs, current_recipient_log)
+
+                # Bound queued sends so the CSV keeps streaming instead of piling up in memory
+                if len(in_flight) >= 2 * len(smtp_conns):
+                    record_results(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                else:
+                    record_results([future for future in in_flight if future.done()])
 
-            print(f"Job {job_uuid[:8]}: Attempting login as {sender_email}...")
-            server.login(sender_email, sender_password)
-            print(f"Job {job_uuid[:8]}: SMTP Login successful.")
+            # Identical bodies go out as one transaction per batch (Bcc); personalized ones one by one
+            batch_size = BCC_BATCH_SIZE if static_body is not None else 1
+            recipients = iter_recipients(csv_path)
+            batch = [] # (first_name, email) read from the CSV but not dispatched yet
+            dispatched = 0 # Recipients handed to the send workers so far
 
             # --- Start Sending Loop ---
-            for i, recipient in enumerate(recipients):
-                # --- Start of Rate Limiting Logic ---
-                waiting_for_rate_limit_reset = False
-                while True: # Loop for rate limit checking and pausing
-                    with rate_limit_lock: # Acquire lock for checking/updating shared variables
-                        # 1. Check if the 1-hour window has passed, reset if necessary
-                        if datetime.now() >= current_hour_start_time + timedelta(hours=1):
-                            print(f"Job {job_uuid[:8]}: Rate limit window from {current_hour_start_time.strftime('%Y-%m-%d %H:%M:%S')} has expired. Resetting count from {hourly_sent_count}.")
-                            hourly_sent_count = 0
-                            current_hour_start_time = datetime.now()
-                            if waiting_for_rate_limit_reset: # If we were paused due to limit
-                                print(f"Job {job_uuid[:8]}: Resumed as rate limit window expired. New window started at {current_hour_start_time.strftime('%Y-%m-%d %H:%M:%S')}.")
-                                try:
-                                    # Ensure 'db' is accessible here, part of the app_context
-                                    db.execute("UPDATE jobs SET status = ? WHERE job_uuid = ?", ('Running', job_uuid))
-                                    db.commit()
-                                except Exception as e_db_update:
-                                    print(f"Job {job_uuid[:8]}: DB Error updating status to Running after rate limit pause: {e_db_update}")
-                                waiting_for_rate_limit_reset = False # No longer waiting
-
-                        # 2. Check if limit is reached within the current window
-                        if hourly_sent_count >= SMTP_HOURLY_LIMIT:
-                            if not waiting_for_rate_limit_reset: # First time hitting the limit in this pause cycle
-                                resume_time_approx = current_hour_start_time + timedelta(hours=1)
-                                status_msg = f'Paused - Hourly Limit ({SMTP_HOURLY_LIMIT}/hr). Resumes ~{resume_time_approx.strftime("%H:%M:%S")}'
-                                print(f"Job {job_uuid[:8]}: {status_msg}")
-                                try:
-                                    db.execute("UPDATE jobs SET status = ? WHERE job_uuid = ?", (status_msg, job_uuid))
-                                    db.commit()
-                                except Exception as e_db_limit:
-                                    print(f"Job {job_uuid[:8]}: DB Error updating status to Paused (limit): {e_db_limit}")
-                                waiting_for_rate_limit_reset = True
-                            # Lock will be released after this 'with' block for this iteration.
-                        else:
-                            # Limit not reached, proceed to send this email.
-                            # If we were waiting and now the limit is NOT reached (e.g. window reset), ensure status is Running.
-                            if waiting_for_rate_limit_reset:
-                                print(f"Job {job_uuid[:8]}: Condition to send met while previously waiting for rate limit. Ensuring status is Running.")
-                                try:
-                                    db.execute("UPDATE jobs SET status = ? WHERE job_uuid = ?", ('Running', job_uuid))
-                                    db.commit()
-                                except Exception as e_db_running:
-                                    print(f"Job {job_uuid[:8]}: DB Error updating status to Running (pre-send check): {e_db_running}")
-                                waiting_for_rate_limit_reset = False # No longer waiting
-                            break # Exit while True loop, proceed to send email for the current recipient
-
-                    # End of 'with rate_limit_lock' for this iteration.
-                    # If we are 'waiting_for_rate_limit_reset', sleep outside the lock before re-looping.
-                    if waiting_for_rate_limit_reset:
-                        # print(f"Job {job_uuid[:8]}: Rate limit active, sleeping for 30s before re-check.") # Optional log
-                        time.sleep(30) # Sleep for 30 seconds then re-evaluate by continuing the while loop.
-                                       # On next iteration, lock is re-acquired at the start of the 'with' block.
-                    # If not waiting_for_rate_limit_reset, the 'break' above would have exited the 'while True' loop.
-                # --- End of Rate Limiting Logic ---
-                
-                first_name = recipient['first_name']
-                to_email = recipient['email']
-                current_recipient_log = f"recipient {i+1}/{total_emails} ({to_email})"
-
-                # Create personalized message
-                msg = MIMEMultipart('alternative')
-                msg['Subject'] = subject
-                msg['From'] = sender_email
-                msg['To'] = to_email
+            # This thread dispatches (rate limit, pacing, DB writes); the workers only render and send
+            # Threads rather than processes: sends are paced and network-bound, and the hourly counters
+            # and the SMTP pool are shared in-process with every other job
+            with ThreadPoolExecutor(max_workers=SMTP_CONNECTIONS_PER_JOB, thread_name_prefix=f"job-{job_uuid[:8]}") as executor:
+                while not connection_error: # Stop dispatching once a connection dropped mid-send
+                    # Top the batch up from the CSV (it only holds leftovers if the budget granted part of it)
+                    batch.extend(islice(recipients, batch_size - len(batch)))
+                    if not batch:
+                        break # Every recipient has been dispatched
+
+                    # --- Pacing: wait out whatever is left of the previous send's share of the window ---
+                    pace_wait = next_send_at - time.monotonic()
+                    if pace_wait > 0:
+                        time.sleep(pace_wait)
+
+                    # --- Start of Rate Limiting Logic ---
+                    while True: # Loop for rate limit checking and pausing
+                        # One reservation (and one pacing step) covers the whole batch
+                        granted, wait_seconds, pace_seconds = reserve_send_slots(len(batch), recipient_count - dispatched)
+                        if granted:
+                            break # Limit not reached, proceed to send
+
+                        resume_time_approx = datetime.now() + timedelta(seconds=wait_seconds)
+                        status_msg = f'Paused - Hourly Limit ({SMTP_HOURLY_LIMIT}/hr). Resumes ~{resume_time_approx.strftime("%H:%M:%S")}'
+                        if status_msg != current_status: # Only write when the status text actually changes
+                            print(f"Job {job_uuid[:8]}: {status_msg}")
+                            try:
+                                db.execute(SQL_UPDATE_STATUS, (status_msg, job_uuid))
+                                db.commit() # Commit now: the job is about to sleep and the dashboard should show it
+                            except Exception as e_db_limit:
+                                print(f"Job {job_uuid[:8]}: DB Error updating status to Paused (limit): {e_db_limit}")
+                            current_status = status_msg
+                        # Sleep (outside the lock) until the window is due to reset, then re-check
+                        time.sleep(max(1, wait_seconds))
+
+                    if current_status != 'Running':
+                        print(f"Job {job_uuid[:8]}: Resumed as rate limit window expired.")
+                        try:
+                            db.execute(SQL_UPDATE_STATUS, ('Running', job_uuid))
+                            db.commit() # Commit now: left open, the write transaction would lock out other writers through the pacing sleep
+                        except Exception as e_db_update:
+                            print(f"Job {job_uuid[:8]}: DB Error updating status to Running after rate limit pause: {e_db_update}")
+                        current_status = 'Running'
+                    # --- End of Rate Limiting Logic ---
+                    next_send_at = time.monotonic() + pace_seconds
+
+                    # Send email: as much of the batch as the budget allowed, the rest goes in the next round
+                    group, batch = batch[:granted], batch[granted:]
+                    if len(group) == 1:
+                        first_name, to_email = group[0]
+                        dispatch(first_name, [to_email], f"recipient {dispatched+1}/{recipient_count} ({to_email})")
+                    else:
+                        dispatch(None, [to_email for _, to_email in group],
+                                 f"recipients {dispatched+1}-{dispatched+len(group)}/{recipient_count}")
+                    dispatched += len(group)
 
-                try:
-                    # Render HTML using Jinja template
-                    personalized_html = email_template.render(
-                        first_name=first_name,
-                        email=to_email
-                        # Add any other variables from CSV if needed
-                    )
-                    part_html = MIMEText(personalized_html, 'html', 'utf-8')
-                    msg.attach(part_html)
-
-                    # Send email
-                    # print(f"Job {job_uuid[:8]}: Sending to {current_recipient_log}...") # Verbose
-                    server.sendmail(sender_email, to_email, msg.as_string())
-                    sent_count += 1
-                    # Update counts immediately for better progress tracking
-                    db.execute("UPDATE jobs SET sent_count = ? WHERE job_uuid = ?", (sent_count, job_uuid))
-                    db.commit()
-                    # print(f"Job {job_uuid[:8]}: Successfully sent to {current_recipient_log}") # Verbose
-
-                    with rate_limit_lock: # Acquire lock to safely update shared counter
-                        hourly_sent_count += 1
-                        # Optional: print(f"Job {job_uuid[:8]}: Email sent. Hourly count: {hourly_sent_count}/{SMTP_HOURLY_LIMIT} in window starting {current_hour_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-                    # --- DELAY ADDED HERE ---
-                    # print(f"Job {job_uuid[:8]}: Pausing for {SEND_DELAY_SECONDS}s...") # Verbose
-                    time.sleep(SEND_DELAY_SECONDS)
-                    # --- END DELAY ---
-
-                except smtplib.SMTPServerDisconnected:
-                     # Specific handling for disconnect DURING the loop
-                     failed_count += 1
-                     error_msg_detail = "Server disconnected unexpectedly (mid-send). Might be rate limited or timed out."
-                     error_msg_short = "SMTPServerDisconnected (mid-send)"
-                     print(f"Job {job_uuid[:8]}: Failed sending to {current_recipient_log} - {error_msg_detail}")
-                     # Log failure to DB
-                     db.execute("INSERT INTO failed_emails (job_uuid, recipient_email, error_message) VALUES (?, ?, ?)",
-                                (job_uuid, to_email, error_msg_short))
-                     # Update job counts and status
-                     db.execute("UPDATE jobs SET failed_count = ?, status = ? WHERE job_uuid = ?",
-                                (failed_count, "Error: Server Disconnected", job_uuid))
-                     db.commit()
-                     print(f"Job {job_uuid[:8]}: Stopping due to mid-send disconnection.")
-                     # Set connection_error flag so finally block knows connection died
-                     connection_error = error_msg_detail
-                     break # Exit the loop - further sends will fail on this connection
-
-                except smtplib.SMTPException as e_send: # Catch other SMTP errors during send
-                    failed_count += 1
-                    error_msg = f"SMTP Error sending to {to_email}: {type(e_send).__name__} - {e_send}"
-                    print(f"Job {job_uuid[:8]}: {error_msg}")
-                    db.execute("INSERT INTO failed_emails (job_uuid, recipient_email, error_message) VALUES (?, ?, ?)",
-                               (job_uuid, to_email, str(e_send)))
-                    db.execute("UPDATE jobs SET failed_count = ? WHERE job_uuid = ?", (failed_count, job_uuid))
-                    db.commit()
-                    # Decide if you want to continue or break on other SMTP errors too (e.g., recipient rejected)
-                    # For now, we continue to try the next recipient unless it was a disconnect.
-
-                except Exception as e_send_general: # Catch non-SMTP errors during send (e.g., template rendering)
-                    failed_count += 1
-                    error_msg = f"General Error sending to {to_email}: {type(e_send_general).__name__} - {e_send_general}"
-                    print(f"Job {job_uuid[:8]}: {error_msg}")
-                    db.execute("INSERT INTO failed_emails (job_uuid, recipient_email, error_message) VALUES (?, ?, ?)",
-                               (job_uuid, to_email, str(e_send_general)))
-                    db.execute("UPDATE jobs SET failed_count = ? WHERE job_uuid = ?", (failed_count, job_uuid))
-                    db.commit()
-                    # Continue trying next recipient
+                # Wait for the sends still in progress
+                record_results(wait(in_flight).done)
 
             # --- End Sending Loop ---
 
@@ -469,6 +894,8 @@ def send_emails_background(job_uuid, csv_path, html_path, subject, sender_email,
             try:
                 # Update DB with final counts and status
                 # Ensure we use the counts calculated, especially if connection_error occurred
+                if failed_buffer:
+                    db.executemany(SQL_INSERT_FAILED, failed_buffer)
                 db.execute("UPDATE jobs SET status = ?, sent_count = ?, failed_count = ?, end_time = ? WHERE job_uuid = ?",
                            (final_status, sent_count, failed_count, end_time, job_uuid))
                 db.commit()
@@ -476,28 +903,29 @@ def send_emails_background(job_uuid, csv_path, html_path, subject, sender_email,
             except sqlite3.Error as e:
                 print(f"Job {job_uuid[:8]}: DB Error updating final status: {e}")
 
-            # --- Cleanly close SMTP connection ---
-            # Check 'server' exists and connection_error wasn't a fatal setup one preventing quit()
-            if server and not connection_error:
-                try:
-                    print(f"Job {job_uuid[:8]}: Closing SMTP connection...")
-                    server.quit()
-                    print(f"Job {job_uuid[:8]}: SMTP connection closed cleanly.")
-                except smtplib.SMTPServerDisconnected:
-                    print(f"Job {job_uuid[:8]}: Server already disconnected before quit command.")
-                except Exception as e_quit:
-                     print(f"Job {job_uuid[:8]}: Error during server.quit(): {e_quit}") # Log if quit fails
-            elif server and connection_error:
+            # --- Return or close the SMTP connections ---
+            if smtp_conns and not connection_error:
+                # Healthy connections: keep them authenticated for the next job
+                for conn in smtp_conns:
+                    release_smtp_connection(conn)
+                print(f"Job {job_uuid[:8]}: {len(smtp_conns)} SMTP connection(s) returned to pool.")
+            elif smtp_conns and connection_error:
                 # If a connection error happened mid-send, quit might still work or might fail
-                print(f"Job {job_uuid[:8]}: Attempting to quit SMTP connection after error...")
-                try:
-                    server.quit()
-                    print(f"Job {job_uuid[:8]}: SMTP connection closed after error.")
-                except Exception as e_quit_err:
-                    print(f"Job {job_uuid[:8]}: Error/Expected failure during server.quit() after error: {e_quit_err}")
+                print(f"Job {job_uuid[:8]}: Closing SMTP connection(s) after error...")
+                for conn in smtp_conns:
+                    retire_smtp_connection(conn)
 
 
-        print(f"Background job {job_uuid[:8]} finished at {datetime.now()}")
+        print(f"Background job {job_uuid[:8]} finished at {end_time} ({time.monotonic() - started_at:.1f}s)")
+    finally:
+        db.close()
+        # The recipient list has been fully streamed (or the job failed); free the disk space
+        try:
+            os.remove(csv_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Job {job_uuid[:8]}: Could not delete CSV file {csv_path}: {e}")
 
 # --- Routes ---
 
@@ -506,8 +934,7 @@ def index():
     if request.method == 'POST':
         # --- Form Data and File Handling ---
         if 'csv_file' not in request.files or 'html_template' not in request.files:
-            flash('Missing file part', 'danger')
-            return redirect(request.url)
+            return submit_error('Missing file part')
 
         csv_file = request.files['csv_file']
         html_file = request.files['html_template']
@@ -521,60 +948,73 @@ def index():
 
         # Basic validation
         if csv_file.filename == '' or html_file.filename == '':
-            flash('No selected file', 'warning')
-            return redirect(request.url)
+            return submit_error('No selected file', 'warning')
         if not subject or not sender_email or not sender_password or not smtp_server or not smtp_port_str:
-             flash('Missing required form fields', 'danger')
-             return redirect(request.url)
+             return submit_error('Missing required form fields')
 
         try:
             smtp_port = int(smtp_port_str)
         except ValueError:
-             flash('Invalid SMTP port number', 'danger')
-             return redirect(request.url)
+             return submit_error('Invalid SMTP port number')
 
         if not allowed_file(csv_file.filename, ALLOWED_EXTENSIONS_CSV):
-            flash('Invalid CSV file type', 'danger')
-            return redirect(request.url)
+            return submit_error('Invalid CSV file type')
         if not allowed_file(html_file.filename, ALLOWED_EXTENSIONS_HTML):
-             flash('Invalid HTML file type', 'danger')
-             return redirect(request.url)
+             return submit_error('Invalid HTML file type')
 
         # Secure filenames and save uploads
         csv_filename = secure_filename(csv_file.filename)
         html_filename = secure_filename(html_file.filename)
         # Add timestamp/UUID to filenames to prevent overwrites
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_csv_filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{csv_filename}"
-        unique_html_filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{html_filename}"
+        upload_tag = f"{time.time_ns()}_{uuid.uuid4().hex[:8]}" # One tag shared by both files of the job
+        unique_csv_filename = f"{upload_tag}_{csv_filename}"
+        unique_html_filename = f"{upload_tag}_{html_filename}"
 
-        csv_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_csv_filename)
+        csv_path = None
         html_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_html_filename)
 
         try:
-            csv_file.save(csv_path)
-            html_file.save(html_path)
+            csv_path = spool_csv(csv_file, upload_tag)
+            html_file.save(html_path, buffer_size=UPLOAD_BUFFER_SIZE)
         except Exception as e:
-             flash(f'Error saving files: {e}', 'danger')
-             print(f"Error saving files: {e}")
-             return redirect(request.url)
+             app.logger.exception("Error saving files: %s", e)
+             if csv_path and os.path.exists(csv_path): os.remove(csv_path)
+             return submit_error(f'Error saving files: {e}', status=500)
+
+        # --- Count Recipients ---
+        # One streaming pass, so the job row is created with its total and a bad CSV is reported right away
+        skipped_rows = [] # Invalid/duplicate rows: recorded as failures with the job, never sent
+        try:
+            recipient_count = sum(1 for _ in iter_recipients(csv_path, skipped_rows))
+        except (ValueError, csv.Error) as e: # Missing columns, undecodable or malformed file
+             app.logger.warning("Error reading CSV: %s", e)
+             os.remove(csv_path)
+             os.remove(html_path)
+             return submit_error(f'Error reading CSV - {e}')
+        total_emails = recipient_count + len(skipped_rows)
 
         # --- Create Job Record in DB ---
         job_uuid = str(uuid.uuid4())
         db = get_db()
         try:
             db.execute(
-                "INSERT INTO jobs (job_uuid, csv_filename, html_filename, subject, sender_email, status) VALUES (?, ?, ?, ?, ?, ?)",
-                (job_uuid, unique_csv_filename, unique_html_filename, subject, sender_email, 'Pending')
+                "INSERT INTO jobs (job_uuid, csv_filename, html_filename, subject, sender_email, status, total_emails, failed_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_uuid, unique_csv_filename, unique_html_filename, subject, sender_email, 'Pending',
+                 total_emails, len(skipped_rows))
             )
+            skipped_at = datetime.now()
+            db.executemany(SQL_INSERT_FAILED, [
+                (job_uuid, email_addr, f"{reason} (CSV row {row_number}); not sent", skipped_at)
+                for row_number, email_addr, reason in skipped_rows
+            ])
             db.commit()
         except sqlite3.Error as e:
-             flash(f'Database error creating job: {e}', 'danger')
-             print(f"Database error creating job: {e}")
+             app.logger.exception("Database error creating job: %s", e)
              # Clean up saved files if DB fails
              if os.path.exists(csv_path): os.remove(csv_path)
              if os.path.exists(html_path): os.remove(html_path)
-             return redirect(request.url)
+             return submit_error(f'Database error creating job: {e}', status=500)
 
 
         # --- Start Background Thread ---
@@ -589,11 +1029,20 @@ def index():
             smtp_server,
             smtp_port,
             use_tls,
-            use_ssl
+            use_ssl,
+            recipient_count,
+            len(skipped_rows)
         ))
         thread.daemon = True # Allows app to exit even if threads are running (use with caution)
         thread.start()
 
+        # The send form polls the job's status itself; a plain form post still lands on the dashboard
+        if wants_json():
+            return jsonify(
+                job_uuid=job_uuid,
+                status_url=url_for('job_status', job_uuid=job_uuid),
+                redirect=url_for('dashboard')
+            ), 202
         flash(f'Email sending job started (Job ID: {job_uuid[:8]}...). Check the dashboard for status.', 'success')
         return redirect(url_for('dashboard'))
 
@@ -603,45 +1052,71 @@ def index():
 
 @app.route('/dashboard')
 def dashboard():
+    page = max(request.args.get('page', 1, type=int), 1)
     db = get_db()
     try:
-        jobs_cursor = db.execute("SELECT * FROM jobs ORDER BY start_time DESC, id DESC")
+        # Only the columns the table shows; one extra row tells us whether a next page exists
+        jobs_cursor = db.execute(
+            SQL_SELECT_JOBS_PAGE,
+            (DASHBOARD_PAGE_SIZE + 1, (page - 1) * DASHBOARD_PAGE_SIZE)
+        )
         jobs = jobs_cursor.fetchall()
     except sqlite3.Error as e:
         flash(f"Error fetching dashboard data: {e}", "danger")
-        print(f"Error fetching dashboard data: {e}")
+        app.logger.exception("Error fetching dashboard data: %s", e)
         jobs = []
-    return render_template('dashboard.html', jobs=jobs)
+    has_next = len(jobs) > DASHBOARD_PAGE_SIZE
+    return render_template('dashboard.html', jobs=jobs[:DASHBOARD_PAGE_SIZE], page=page, has_next=has_next)
 
 @app.route('/dashboard/failures/<job_uuid>')
 def job_failures(job_uuid):
-     # --- Optional: Route to view specific failures for a job ---
+     page = max(request.args.get('page', 1, type=int), 1)
      db = get_db()
      try:
-        job_cursor = db.execute("SELECT * FROM jobs WHERE job_uuid = ?", (job_uuid,))
+        job_cursor = db.execute(SQL_SELECT_JOB_SUMMARY, (job_uuid,))
         job = job_cursor.fetchone()
         if not job:
              flash("Job not found.", "warning")
              return redirect(url_for('dashboard'))
 
+        # One extra row tells us whether a next page exists (failed_count can exceed the logged rows,
+        # e.g. when a job couldn't connect and every recipient counts as failed)
         failures_cursor = db.execute(
-            "SELECT recipient_email, error_message, timestamp FROM failed_emails WHERE job_uuid = ? ORDER BY timestamp DESC",
-            (job_uuid,)
+            SQL_SELECT_FAILURES_PAGE,
+            (job_uuid, FAILURES_PAGE_SIZE + 1, (page - 1) * FAILURES_PAGE_SIZE)
         )
         failures = failures_cursor.fetchall()
 
      except sqlite3.Error as e:
          flash(f"Error fetching failure data: {e}", "danger")
-         print(f"Error fetching failure data: {e}")
+         app.logger.exception("Error fetching failure data: %s", e)
          return redirect(url_for('dashboard'))
 
-     # You would create a new template 'job_failures.html' to display this data
-     # return render_template('job_failures.html', job=job, failures=failures)
-     # For now, just show a basic message or redirect
-     flash(f"Displaying failures for Job {job_uuid[:8]}... (Implementation for display page needed)", "info")
-     # Example: return basic info for now
-     failure_info = "<br>".join([f"{f['timestamp']}: {f['recipient_email']} - {f['error_message']}" for f in failures])
-     return f"<h1>Failures for Job {job['job_uuid'][:8]}</h1><p>Subject: {job['subject']}</p><p>Total Failures: {job['failed_count']}</p><hr><p>{failure_info}</p><a href='{url_for('dashboard')}'>Back to Dashboard</a>"
+     has_next = len(failures) > FAILURES_PAGE_SIZE
+     return render_template('job_failures.html', job=job, failures=failures[:FAILURES_PAGE_SIZE], page=page, has_next=has_next)
+
+
+@app.route('/jobs/<job_uuid>/status')
+def job_status(job_uuid):
+    """Progress of a single job, polled by the send form after submitting."""
+    db = get_db()
+    try:
+        job = db.execute(SQL_SELECT_JOB_STATUS, (job_uuid,)).fetchone()
+    except sqlite3.Error as e:
+        app.logger.exception("Error fetching job status: %s", e)
+        return jsonify(error=f"Error fetching job status: {e}"), 500
+    if not job:
+        return jsonify(error="Job not found."), 404
+
+    return jsonify(
+        job_uuid=job_uuid,
+        status=job['status'],
+        total_emails=job['total_emails'],
+        sent_count=job['sent_count'],
+        failed_count=job['failed_count'],
+        finished=job['end_time'] is not None,
+        failures_url=url_for('job_failures', job_uuid=job_uuid) if job['failed_count'] else None
+    )
 
 
 # --- Main Execution ---
@@ -650,12 +1125,13 @@ if __name__ == '__main__':
     if not os.path.exists(app.instance_path):
         os.makedirs(app.instance_path)
 
-    # You might want to add a Flask CLI command to initialize the DB cleanly
-    # Example: flask --app app init-db
-    # @app.cli.command('init-db')
-    # def init_db_command():
-    #     """Clear existing data and create new tables."""
-    #     init_db()
-    #     click.echo('Initialized the database.')
+    # Create the schema on first run; otherwise use `flask --app app init-db`
+    if not os.path.exists(app.config['DATABASE']):
+        init_db()
 
-    app.run(debug=True) # Turn off debug mode in production!
+    # Debug mode (reloader, debugger, template mtime checks) is opt-in: FLASK_DEBUG=1
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    app.config['TEMPLATES_AUTO_RELOAD'] = debug
+    app.jinja_env.auto_reload = debug
+    # Threaded so dashboard requests don't queue behind each other; only listens locally unless FLASK_RUN_HOST is set
+    app.run(debug=debug, threaded=True, host=os.environ.get('FLASK_RUN_HOST', '127.0.0.1'))
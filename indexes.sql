@@ -0,0 +1,7 @@
+-- Indexes only: safe to run against an existing database (applied on first connection, see connect_db)
+
+-- The failures view filters failed_emails by job and lists them newest first
+CREATE INDEX IF NOT EXISTS idx_failed_job_ts ON failed_emails(job_uuid, timestamp DESC);
+
+-- The dashboard lists jobs newest first, one page at a time
+CREATE INDEX IF NOT EXISTS idx_jobs_start ON jobs(start_time DESC, id DESC);
@@ -0,0 +1,26 @@
+DROP TABLE IF EXISTS jobs;
+DROP TABLE IF EXISTS failed_emails;
+
+CREATE TABLE jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_uuid TEXT UNIQUE NOT NULL,
+    csv_filename TEXT NOT NULL,
+    html_filename TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    sender_email TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'Pending', -- Pending, Running, Completed, Failed, Partial Failure
+    total_emails INTEGER,
+    sent_count INTEGER DEFAULT 0,
+    failed_count INTEGER DEFAULT 0,
+    start_time TIMESTAMP,
+    end_time TIMESTAMP
+);
+
+CREATE TABLE failed_emails (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_uuid TEXT NOT NULL,
+    recipient_email TEXT NOT NULL,
+    error_message TEXT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (job_uuid) REFERENCES jobs (job_uuid)
+);